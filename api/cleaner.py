@@ -1,27 +1,101 @@
 import polars as pl
-from datetime import datetime
-from models import CleansingConfig
-import io
-import re
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from models import CleansingConfig, PrescriptionRules, ImmunityRules, ExemptionRules, IncompleteRules
+from typing import Union
 
-def process_file(file_content: bytes, filename: str, config: CleansingConfig) -> (pl.DataFrame, dict):
-    # Load Data
+# Every value Status_Higienizacao can take, stored as compact category codes
+STATUS_DTYPE = pl.Enum(['Válido', 'Prescrito', 'Imune', 'Isento', 'Dados Incompletos'])
+
+@lru_cache(maxsize=64)
+def build_status_exprs(rules_key: str, today: date) -> (pl.Expr, pl.Expr):
+    """Builds the status and reason expressions for the serialized rule settings."""
+    rules_config = json.loads(rules_key)
+    prescription = PrescriptionRules(**rules_config['prescription'])
+    immunity = ImmunityRules(**rules_config['immunity'])
+    exemption = ExemptionRules(**rules_config['exemption'])
+    incomplete = IncompleteRules(**rules_config['incomplete'])
+
+    # --- RULES PROCESSING ---
+    # Each rule is a (condition, status, reason) tuple; the first match wins
+    rules = []
+    
+    # 1. Prescription
+    if prescription.enabled:
+        ref_date = today
+        if prescription.reference_date:
+            try:
+                ref_date = datetime.strptime(prescription.reference_date, "%Y-%m-%d").date()
+            except:
+                pass
+        
+        cutoff_date = ref_date.replace(year=ref_date.year - prescription.years)
+        
+        rules.append((
+            pl.col('_temp_date') < cutoff_date,
+            'Prescrito',
+            f'Vencimento anterior a {cutoff_date.strftime("%d/%m/%Y")}'
+        ))
+
+    # 2. Immunity
+    if immunity.enabled and immunity.keywords:
+        keywords = [k.upper() for k in immunity.keywords]
+        
+        rules.append((
+            pl.col('_temp_name').str.contains_any(keywords),
+            'Imune',
+            'Entidade Imune identificada por palavra-chave'
+        ))
+
+    # 3. Exemption
+    if exemption.enabled:
+        if exemption.amount_threshold > 0:
+            rules.append((
+                pl.col('_temp_amount') < exemption.amount_threshold,
+                'Isento',
+                f'Valor abaixo de R$ {exemption.amount_threshold}'
+            ))
+        
+        if exemption.tributes:
+            tributes = [t.upper() for t in exemption.tributes]
+            rules.append((
+                pl.col('_temp_tribute').is_in(tributes),
+                'Isento',
+                'Tributo Isento'
+            ))
+
+    # 4. Incomplete
+    if incomplete.enabled:
+        bad_name = pl.col('_temp_name').str.len_chars() < 3
+        if incomplete.keywords:
+            keywords = [k.upper() for k in incomplete.keywords]
+            bad_name = bad_name | pl.col('_temp_name').str.contains_any(keywords)
+        bad_data = bad_name
+        if incomplete.check_cpf_cnpj:
+            bad_data = bad_data | ~pl.col('_temp_has_doc')
+        
+        rules.append((
+            bad_data,
+            'Dados Incompletos',
+            'Nome ou CPF/CNPJ inválido/genérico'
+        ))
+
+    # Fold the rules into a single expression so the lazy engine scans once
+    status = pl.lit('Válido')
+    reason = pl.lit('')
+    for condition, rule_status, rule_reason in reversed(rules):
+        status = pl.when(condition).then(pl.lit(rule_status)).otherwise(status)
+        reason = pl.when(condition).then(pl.lit(rule_reason)).otherwise(reason)
+
+    return status, reason
+
+def process_file(source: Union[str, bytes], filename: str, config: CleansingConfig) -> (pl.DataFrame, dict):
+    # Load Data (from a file path or the raw file bytes)
     try:
-        if filename.endswith(".xlsx"):
-            df = pl.read_excel(io.BytesIO(file_content))
-        elif filename.endswith(".xls"):
-            # Polars doesn't support .xls directly, use xlsx2csv workaround
-            import xlrd
-            workbook = xlrd.open_workbook(file_contents=file_content)
-            sheet = workbook.sheet_by_index(0)
-            data = []
-            headers = [str(cell.value) for cell in sheet.row(0)]
-            for row_idx in range(1, sheet.nrows):
-                row_data = {}
-                for col_idx, header in enumerate(headers):
-                    row_data[header] = sheet.cell_value(row_idx, col_idx)
-                data.append(row_data)
-            df = pl.DataFrame(data)
+        if filename.endswith((".xlsx", ".xls")):
+            # calamine reads both formats straight into Arrow columns
+            df = pl.read_excel(source, engine="calamine")
         else:
             raise ValueError("Unsupported file format. Use .xlsx or .xls")
     except Exception as e:
@@ -36,155 +110,108 @@ def process_file(file_content: bytes, filename: str, config: CleansingConfig) ->
     if missing:
         raise ValueError(f"Missing columns in file: {', '.join(missing)}")
 
-    # Helper function to parse dates
-    def parse_date(val):
-        if val is None:
-            return None
-        try:
-            if isinstance(val, datetime):
-                return val
-            if isinstance(val, str):
-                # Try common formats
-                for fmt in ["%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"]:
-                    try:
-                        return datetime.strptime(val, fmt)
-                    except:
-                        continue
-            return None
-        except:
-            return None
-
-    # Helper for Amount
-    def parse_amount(val):
-        if val is None:
-            return 0.0
-        try:
-            if isinstance(val, (int, float)):
-                return float(val)
-            if isinstance(val, str):
-                x = val.replace('R$', '').replace(' ', '')
-                if ',' in x and '.' in x:
-                    x = x.replace('.', '').replace(',', '.')
-                elif ',' in x:
-                    x = x.replace(',', '.')
-                return float(x)
-            return 0.0
-        except:
-            return 0.0
-
-    # Process with Polars - convert to Python for complex logic
-    data = df.to_dicts()
-    
-    for row in data:
-        row['_temp_date'] = parse_date(row.get(mapping.due_date))
-        row['_temp_amount'] = parse_amount(row.get(mapping.amount))
-        row['_temp_name'] = str(row.get(mapping.taxpayer_name) or '').upper()
-        
-        if mapping.cpf_cnpj and mapping.cpf_cnpj in df.columns:
-            doc = str(row.get(mapping.cpf_cnpj) or '')
-            row['_temp_doc'] = re.sub(r'[^0-9]', '', doc)
-        else:
-            row['_temp_doc'] = ''
-            
-        if mapping.tribute_type and mapping.tribute_type in df.columns:
-            row['_temp_tribute'] = str(row.get(mapping.tribute_type) or '').upper()
-        else:
-            row['_temp_tribute'] = ''
-        
-        row['Status_Higienizacao'] = 'Válido'
-        row['Motivo_Higienizacao'] = ''
+    # Helpers to build the parsed columns as Polars expressions
+    def parse_date(col):
+        # Day precision is enough, so dates are kept as 32-bit pl.Date.
+        # Date cells already come typed from the reader
+        if df.schema[col] in (pl.Date, pl.Datetime):
+            return pl.col(col).cast(pl.Date)
+        # Try common formats, keeping the first that parses. Polars' %Y also
+        # takes 1-2 digit years ("10/05/25" -> year 25), so each format is
+        # gated by a pattern that requires a 4-digit year.
+        text = pl.col(col).cast(pl.Utf8)
+        formats = {
+            "%d/%m/%Y": r"^\d{1,2}/\d{1,2}/\d{4}$",
+            "%Y-%m-%d": r"^\d{4}-\d{1,2}-\d{1,2}$",
+            "%d-%m-%Y": r"^\d{1,2}-\d{1,2}-\d{4}$",
+        }
+        return pl.coalesce([
+            pl.when(text.str.contains(pattern)).then(text.str.strptime(pl.Date, fmt, strict=False))
+            for fmt, pattern in formats.items()
+        ])
+
+    def parse_amount(col):
+        if df.schema[col].is_numeric():
+            return pl.col(col).cast(pl.Float64).fill_null(0.0)
+        # \s is Unicode-aware, so tabs and the non-breaking space used in
+        # pt-BR currency formatting are stripped along with plain spaces
+        x = pl.col(col).cast(pl.Utf8).str.replace_all(r"R\$|\s", "")
+        # "1.234,56" -> "1234.56"; "10,5" -> "10.5"
+        x = pl.when(x.str.contains(",", literal=True)).then(
+            x.str.replace_all(".", "", literal=True).str.replace(",", ".", literal=True)
+        ).otherwise(x)
+        return x.cast(pl.Float64, strict=False).fill_null(0.0)
+
+    def parse_text(col):
+        return pl.col(col).cast(pl.Utf8).fill_null("").str.to_uppercase()
+
+    # Process with Polars expressions, keeping the data columnar.
+    # Only the helper columns read by an enabled rule are built.
+    needs_name = (config.immunity.enabled and config.immunity.keywords) or config.incomplete.enabled
+    needs_doc = config.incomplete.enabled and config.incomplete.check_cpf_cnpj
+    needs_tribute = config.exemption.enabled and config.exemption.tributes
+
+    temp_cols = [parse_amount(mapping.amount).alias('_temp_amount')]
 
-    # --- RULES PROCESSING ---
-    
-    # 1. Prescription
     if config.prescription.enabled:
-        ref_date = datetime.now()
-        if config.prescription.reference_date:
-            try:
-                ref_date = datetime.strptime(config.prescription.reference_date, "%Y-%m-%d")
-            except:
-                pass
-        
-        cutoff_date = ref_date.replace(year=ref_date.year - config.prescription.years)
-        
-        for row in data:
-            if row['Status_Higienizacao'] == 'Válido':
-                temp_date = row['_temp_date']
-                if temp_date and temp_date < cutoff_date:
-                    row['Status_Higienizacao'] = 'Prescrito'
-                    row['Motivo_Higienizacao'] = f'Vencimento anterior a {cutoff_date.strftime("%d/%m/%Y")}'
+        temp_cols.append(parse_date(mapping.due_date).alias('_temp_date'))
 
-    # 2. Immunity
-    if config.immunity.enabled:
-        keywords = [k.upper() for k in config.immunity.keywords]
-        pattern = re.compile('|'.join(map(re.escape, keywords)))
-        
-        for row in data:
-            if row['Status_Higienizacao'] == 'Válido':
-                if pattern.search(row['_temp_name']):
-                    row['Status_Higienizacao'] = 'Imune'
-                    row['Motivo_Higienizacao'] = 'Entidade Imune identificada por palavra-chave'
+    if needs_name:
+        temp_cols.append(parse_text(mapping.taxpayer_name).alias('_temp_name'))
 
-    # 3. Exemption
-    if config.exemption.enabled:
-        if config.exemption.amount_threshold > 0:
-            for row in data:
-                if row['Status_Higienizacao'] == 'Válido':
-                    if row['_temp_amount'] < config.exemption.amount_threshold:
-                        row['Status_Higienizacao'] = 'Isento'
-                        row['Motivo_Higienizacao'] = f'Valor abaixo de R$ {config.exemption.amount_threshold}'
-        
-        if config.exemption.tributes:
-            tributes = [t.upper() for t in config.exemption.tributes]
-            for row in data:
-                if row['Status_Higienizacao'] == 'Válido':
-                    if row['_temp_tribute'] in tributes:
-                        row['Status_Higienizacao'] = 'Isento'
-                        row['Motivo_Higienizacao'] = 'Tributo Isento'
+    if needs_doc:
+        if mapping.cpf_cnpj and mapping.cpf_cnpj in df.columns:
+            # Only whether any digit is left matters, so skip building the stripped string
+            temp_cols.append(
+                pl.col(mapping.cpf_cnpj).cast(pl.Utf8).str.contains(r'[0-9]').fill_null(False).alias('_temp_has_doc')
+            )
+        else:
+            temp_cols.append(pl.lit(False).alias('_temp_has_doc'))
 
-    # 4. Incomplete
-    if config.incomplete.enabled:
-        keywords = [k.upper() for k in config.incomplete.keywords]
-        pattern = re.compile('|'.join(map(re.escape, keywords)))
-        
-        for row in data:
-            if row['Status_Higienizacao'] == 'Válido':
-                bad_name = pattern.search(row['_temp_name']) or len(row['_temp_name']) < 3
-                bad_doc = config.incomplete.check_cpf_cnpj and row['_temp_doc'] == ''
-                
-                if bad_name or bad_doc:
-                    row['Status_Higienizacao'] = 'Dados Incompletos'
-                    row['Motivo_Higienizacao'] = 'Nome ou CPF/CNPJ inválido/genérico'
+    if needs_tribute:
+        if mapping.tribute_type and mapping.tribute_type in df.columns:
+            temp_cols.append(parse_text(mapping.tribute_type).alias('_temp_tribute'))
+        else:
+            temp_cols.append(pl.lit('').alias('_temp_tribute'))
 
-    # Clean up temp columns
-    for row in data:
-        del row['_temp_date']
-        del row['_temp_amount']
-        del row['_temp_name']
-        del row['_temp_doc']
-        del row['_temp_tribute']
+    # Rule expressions only depend on the rule settings, so they are cached
+    rules_key = config.model_dump_json(exclude={'mapping'})
+    status, reason = build_status_exprs(rules_key, date.today())
 
-    # Convert back to Polars DataFrame
-    result_df = pl.DataFrame(data)
+    df = (
+        df.lazy()
+        .with_columns(temp_cols)
+        .with_columns([
+            status.cast(STATUS_DTYPE).alias('Status_Higienizacao'),
+            reason.cast(pl.Categorical).alias('Motivo_Higienizacao'),
+        ])
+        .collect(engine="streaming")
+    )
 
     # Calculate summary
+    agg = df.group_by('Status_Higienizacao').agg([
+        pl.len().alias('n'),
+        pl.col('_temp_amount').sum().alias('amt'),
+    ]).to_dicts()
+
     status_counts = {}
     total_removed = 0.0
     total_valid = 0.0
-    
-    for row in data:
+
+    for row in agg:
         status = row['Status_Higienizacao']
-        status_counts[status] = status_counts.get(status, 0) + 1
-        
-        amount = parse_amount(row.get(mapping.amount))
+        status_counts[status] = row['n']
         if status != 'Válido':
-            total_removed += amount
+            total_removed += row['amt']
         else:
-            total_valid += amount
+            total_valid += row['amt']
+
+    # Clean up temp columns
+    result_df = df.drop([c.meta.output_name() for c in temp_cols])
 
     summary = {
-        "total_records": len(data),
-        "processed_records": len(data), 
+        "total_records": result_df.height,
+        "processed_records": result_df.height,
         "prescribed_count": status_counts.get('Prescrito', 0),
         "immune_count": status_counts.get('Imune', 0),
         "exempt_count": status_counts.get('Isento', 0),
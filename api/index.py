@@ -1,15 +1,31 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import ValidationError
+import asyncio
+import hashlib
 import json
 import io
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
 import polars as pl
+import xlsxwriter
+from cachetools import TTLCache
 from starlette.responses import StreamingResponse
 
 from cleaner import process_file
 from models import CleansingConfig, CleansingResult
 
-app = FastAPI(title="Higienizador de Dívida Ativa API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    if process_pool is not None:
+        process_pool.shutdown(cancel_futures=True)
+
+app = FastAPI(title="Higienizador de Dívida Ativa API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,25 +35,111 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Worker processes for process_file, created on first use. Polars is
+# multithreaded, so workers are spawned rather than forked.
+process_pool = None
+
+# Each worker runs its own Polars thread pool, so split the cores between
+# them instead of starting cpu_count threads in every worker
+PROCESS_WORKERS = min(4, os.cpu_count() or 1)
+WORKER_POLARS_THREADS = max(1, (os.cpu_count() or 1) // PROCESS_WORKERS)
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global process_pool
+    if process_pool is None:
+        # Spawned workers inherit the environment, and Polars reads this on import
+        os.environ.setdefault("POLARS_MAX_THREADS", str(WORKER_POLARS_THREADS))
+        process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return process_pool
+
+def discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    """Drops a broken pool so the next call builds a fresh one."""
+    global process_pool
+    if process_pool is pool:
+        process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+# Processed results keyed by (file hash, config hash), so /export can reuse /process
+results_cache = TTLCache(maxsize=16, ttl=600)
+
+async def save_upload(file: UploadFile) -> (str, str):
+    """Streams the upload to a temporary file and returns its path and SHA-256."""
+    suffix = os.path.splitext(file.filename)[1]
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                # A blocking write, but short enough at 1 MiB chunks
+                tmp.write(chunk)
+        except BaseException:
+            # The caller never gets the path, so clean up here (e.g. client disconnect)
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return tmp.name, digest.hexdigest()
+
+async def get_processed(path: str, file_hash: str, filename: str, config: CleansingConfig):
+    """Returns the cached result for this file and config, processing it on a miss."""
+    config_hash = hashlib.sha256(config.model_dump_json().encode()).hexdigest()
+    key = (file_hash, filename, config_hash)
+    # Single lookup: the entry could expire between a membership test and a read
+    result = results_cache.get(key)
+    if result is None:
+        # Run the CPU-bound pipeline in a worker process, off the event loop
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = get_process_pool()
+            try:
+                result = await loop.run_in_executor(pool, process_file, path, filename, config)
+                break
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM kill); replace the pool and retry once
+                discard_process_pool(pool)
+                if attempt:
+                    raise
+        results_cache[key] = result
+    return result
+
+def write_xlsx(df: pl.DataFrame, output) -> None:
+    """Writes the frame row by row in xlsxwriter's constant_memory mode."""
+    # Same cell handling as DataFrame.write_excel: text stays literal text
+    # (no formulas or hyperlinks) and NaN/Inf become error cells
+    options = {
+        "constant_memory": True,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+        "nan_inf_to_errors": True,
+        "use_zip64": True,
+        "default_date_format": "dd/mm/yyyy",
+    }
+    with xlsxwriter.Workbook(output, options) as workbook:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, df.columns, workbook.add_format({"bold": True}))
+        for row_idx, row in enumerate(df.iter_rows(), start=1):
+            worksheet.write_row(row_idx, 0, row)
+        worksheet.autofilter(0, 0, df.height, df.width - 1)
+
 @app.post("/analyze-headers")
 async def analyze_headers(file: UploadFile = File(...)):
     """Reads the first few rows to return column headers for mapping."""
+    if not file.filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+
+    path, _ = await save_upload(file)
     try:
-        content = await file.read()
-        if file.filename.endswith(".xlsx"):
-            df = pl.read_excel(io.BytesIO(content))
-        elif file.filename.endswith(".xls"):
-            import xlrd
-            workbook = xlrd.open_workbook(file_contents=content)
-            sheet = workbook.sheet_by_index(0)
-            headers = [str(cell.value) for cell in sheet.row(0)]
-            return {"columns": headers}
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file format")
-            
+        # Only the header row is needed for mapping
+        df = pl.read_excel(path, engine="calamine", read_options={"n_rows": 0})
         return {"columns": df.columns}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+    finally:
+        os.remove(path)
 
 @app.post("/process")
 async def process_debt_file(
@@ -51,10 +153,10 @@ async def process_debt_file(
     except (json.JSONDecodeError, ValidationError) as e:
         raise HTTPException(status_code=400, detail=f"Invalid configuration: {str(e)}")
 
-    content = await file.read()
+    path, file_hash = await save_upload(file)
     
     try:
-        processed_df, summary = process_file(content, file.filename, clean_config)
+        processed_df, summary = await get_processed(path, file_hash, file.filename, clean_config)
         
         # Convert preview to dict
         preview = processed_df.head(100).to_dicts()
@@ -65,21 +167,25 @@ async def process_debt_file(
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    finally:
+        os.remove(path)
 
 @app.post("/export")
 async def export_debt_file(
     file: UploadFile = File(...),
     config: str = Form(...)
 ):
-    """Re-processes and returns the full Excel file."""
+    """Returns the full Excel file, re-processing only if the result is not cached."""
+    path = None
     try:
         config_dict = json.loads(config)
         clean_config = CleansingConfig(**config_dict)
-        content = await file.read()
-        processed_df, _ = process_file(content, file.filename, clean_config)
+        path, file_hash = await save_upload(file)
+        processed_df, _ = await get_processed(path, file_hash, file.filename, clean_config)
         
         output = io.BytesIO()
-        processed_df.write_excel(output)
+        # The row-by-row write is pure Python, so keep it off the event loop
+        await asyncio.to_thread(write_xlsx, processed_df, output)
         output.seek(0)
         
         return StreamingResponse(
@@ -90,6 +196,9 @@ async def export_debt_file(
         
     except Exception as e:
          raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+    finally:
+        if path:
+            os.remove(path)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,7 +1,10 @@
-import pandas as pd
+import polars as pl
 import sys
 import os
 import glob
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # Add current directory to path so we can import modules
 sys.path.append(os.getcwd())
@@ -10,19 +13,20 @@ from cleaner import process_file
 from models import CleansingConfig, ColumnMapping, PrescriptionRules, ImmunityRules, ExemptionRules, IncompleteRules
 
 def test_on_file(filepath):
-    print(f"\n--- Testing on {os.path.basename(filepath)} ---")
+    # Returns the report as text so parallel workers don't interleave output
+    lines = [f"\n--- Testing on {os.path.basename(filepath)} ---"]
     
     # Simple heuristic to guess mapping based on filename or content columns
     # In the real app, the user does this via UI. Here we hardcode for the test.
     
     try:
         # Read header to guess columns
-        df_head = pd.read_excel(filepath, nrows=0)
+        df_head = pl.read_excel(filepath, engine="calamine", read_options={"n_rows": 0})
         cols = set(df_head.columns)
         
         mapping = None
         if "Numero da Dívida" in cols or "Numero da Dvida" in cols: # Brumado likely
-            print("Detected Brumado format")
+            lines.append("Detected Brumado format")
             # Handle potential encoding weirdness in column names
             debt_id = "Numero da Dívida" if "Numero da Dívida" in cols else [c for c in cols if "Numero da D" in c][0]
             
@@ -34,7 +38,7 @@ def test_on_file(filepath):
                 amount="Total"
             )
         elif "Nº Dívida Ativa" in cols or "N Dvida Ativa" in cols: # Tanhacu likely
-            print("Detected Tanhacu format")
+            lines.append("Detected Tanhacu format")
             debt_id = "Nº Dívida Ativa" if "Nº Dívida Ativa" in cols else [c for c in cols if "D" in c and "vida" in c and "Ativa" in c][0]
             due_date = "Vencimento" if "Vencimento" in cols else "Data Inscrição" # Fallback
             
@@ -46,8 +50,8 @@ def test_on_file(filepath):
                 tribute_type="Tributo"
             )
         else:
-            print(f"Unknown format. Columns: {cols}")
-            return
+            lines.append(f"Unknown format. Columns: {cols}")
+            return "\n".join(lines)
 
         with open(filepath, 'rb') as f:
             content = f.read()
@@ -61,18 +65,65 @@ def test_on_file(filepath):
         )
 
         df, summary = process_file(content, filepath, config)
-        print("Summary:", summary)
+        lines.append(f"Summary: {summary}")
         
     except Exception as e:
-        print(f"Error processing {filepath}: {e}")
+        lines.append(f"Error processing {filepath}: {e}")
         import traceback
-        traceback.print_exc()
+        lines.append(traceback.format_exc())
+
+    return "\n".join(lines)
+
+def check_export_roundtrip():
+    """Checks that exported text stays literal and NaN comes back as a blank cell."""
+    from index import write_xlsx
+
+    df = pl.DataFrame({
+        "Nome Contribuinte": ["=SUM(A1)", "http://example.com"],
+        "Total": [float("nan"), 1.5],
+    })
+    output = io.BytesIO()
+    write_xlsx(df, output)
+    back = pl.read_excel(output.getvalue(), engine="calamine")
+
+    assert back["Nome Contribuinte"].to_list() == ["=SUM(A1)", "http://example.com"], back
+    assert back["Total"].to_list() == [None, 1.5], back
+    print("Export round trip OK")
+
+def check_two_digit_years():
+    """Checks that dates with 1-2 digit years are left unparsed, not read as year 0025."""
+    df = pl.DataFrame({
+        "ID": [1, 2, 3],
+        "Nome": ["Fulano de Tal"] * 3,
+        "Vencimento": ["10/05/25", "15-03-24", "10/05/2015"],
+        "Valor": ["100,00"] * 3,
+    })
+    output = io.BytesIO()
+    df.write_excel(output)
+
+    config = CleansingConfig(
+        mapping=ColumnMapping(debt_id="ID", taxpayer_name="Nome", due_date="Vencimento", amount="Valor"),
+        prescription=PrescriptionRules(enabled=True, years=5, reference_date="2024-06-01"),
+        immunity=ImmunityRules(enabled=False),
+        exemption=ExemptionRules(enabled=False),
+        incomplete=IncompleteRules(enabled=False)
+    )
+    result, _ = process_file(output.getvalue(), "dates.xlsx", config)
+
+    assert result["Status_Higienizacao"].cast(pl.Utf8).to_list() == ["Válido", "Válido", "Prescrito"], result
+    print("Two-digit years OK")
 
 if __name__ == "__main__":
     # Find xlsx files in the PARENT directory (project root)
     # The CWD when running this script via run_command is the project root.
+    check_export_roundtrip()
+    check_two_digit_years()
+
     files = glob.glob("*.xlsx")
     print(f"Found {len(files)} files: {files}")
     
-    for f in files:
-        test_on_file(f)
+    # Each file is independent, so check them in parallel
+    # Polars is multithreaded, so workers are spawned rather than forked
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as ex:
+        for report in ex.map(test_on_file, files):
+            print(report)
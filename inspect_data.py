@@ -1,20 +1,29 @@
-import pandas as pd
+import polars as pl
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 files = [
     "Higienização da Dívida Ativa - Brumado.xlsx",
     "higienização da divida ativa - tanhaçu.xlsx"
 ]
 
-for f in files:
-    if os.path.exists(f):
-        print(f"--- Processing {f} ---")
-        try:
-            df = pd.read_excel(f, nrows=5)
-            print("Columns:", df.columns.tolist())
-            print("Types:", df.dtypes)
-            print("Sample Data:\n", df.head())
-        except Exception as e:
-            print(f"Error reading {f}: {e}")
-    else:
-        print(f"File not found: {f}")
+def inspect_file(f):
+    # Returns the report as text so parallel workers don't interleave output
+    if not os.path.exists(f):
+        return f"File not found: {f}"
+    lines = [f"--- Processing {f} ---"]
+    try:
+        df = pl.read_excel(f, engine="calamine", read_options={"n_rows": 5})
+        lines.append(f"Columns: {df.columns}")
+        lines.append(f"Types: {df.schema}")
+        lines.append(f"Sample Data:\n {df.head()}")
+    except Exception as e:
+        lines.append(f"Error reading {f}: {e}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # Polars is multithreaded, so workers are spawned rather than forked
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as ex:
+        for report in ex.map(inspect_file, files):
+            print(report)